@@ -4,19 +4,130 @@
 """
 
 import argparse
+import asyncio
+import cProfile
+import hashlib
+import httpx
 import json
 import logging
+import logging.handlers
+import mmap
+import os
+import random
 import re
-import requests
-import sys
-import time
-import traceback
-from typing import List, Dict, Any, Optional, TextIO
+import stat
+from typing import List, Dict, Any, Optional, TextIO, Tuple
+
+try:
+    import diskcache
+except ImportError:  # 可选依赖，未安装时不启用结果缓存
+    diskcache = None
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # 可选依赖，未安装时退回标准库json
+    _json_loads = json.loads
+
+# SYSTEM_PROMPT或输出格式变化时递增，使旧的缓存结果失效
+SCHEMA_VERSION = "1"
+
+# 章节标题格式："第X章 标题"（第2组为章节序号）
+_CHAPTER_RE = re.compile(r'(第([0-9零一二三四五六七八九十百千万]+)章\s[^\n]+)\n')
+
+# 中文数字与单位
+_CN_NUM = {
+    '零': 0, '一': 1, '二': 2, '三': 3, '四': 4,
+    '五': 5, '六': 6, '七': 7, '八': 8, '九': 9,
+    '十': 10, '百': 100, '千': 1000, '万': 10000
+}
+
+# 对白提示（"某某道/说/笑..."），用于在调用模型前粗略判断章节是否包含人物
+_DIALOG_HINT = re.compile(r'[\u4e00-\u9fa5]{2,3}(?:道|说|笑|问|答|喝|叫|怒|喊)')
+
+# 合并同名角色时保留最详细信息的字段
+_MERGE_FIELDS = ('appearance', 'personality', 'relationships', 'significance')
+
+
+def _parse_cn_int(s: str) -> int:
+    """解析章节序号，支持阿拉伯数字和中文数字（如'一百零五'、'十二'）"""
+    if s.isdigit():
+        return int(s)
+    total = section = digit = 0
+    for ch in s:
+        value = _CN_NUM.get(ch)
+        if value is None:
+            value = int(ch)  # 混写的阿拉伯数字
+        if value < 10:
+            digit = value
+        elif value == 10000:
+            total += (section + digit) * value
+            section = digit = 0
+        else:
+            section += (digit or 1) * value  # "十二"中省略的"一"
+            digit = 0
+    return total + section + digit
+
+
+def _trim_indices(s: str, lo: int, hi: int) -> Tuple[int, int]:
+    """计算s[lo:hi]去除首尾空白后的区间，避免strip()产生额外的字符串副本"""
+    while lo < hi and s[lo].isspace():
+        lo += 1
+    while hi > lo and s[hi - 1].isspace():
+        hi -= 1
+    return lo, hi
+
+
+
+class _BriefFormatter(logging.Formatter):
+    """不输出堆栈跟踪的格式化器"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        # 其他处理器仍需要exc_info，格式化后恢复
+        exc_info, exc_text = record.exc_info, record.exc_text
+        record.exc_info = record.exc_text = None
+        try:
+            return super().format(record)
+        finally:
+            record.exc_info, record.exc_text = exc_info, exc_text
 
 class NovelAnalyzer:
     """小说角色分析器（模块化设计）"""
     
-    def __init__(self, model_name: str = "qwen3:4b"):
+    # 固定的指令与输出格式，作为system消息放在每次请求的最前面，
+    # 章节文本只出现在随后的user消息中，便于服务端复用提示前缀的KV缓存
+    SYSTEM_PROMPT = """你是一名专业的小说人物分析助手。用户会提供一个或多个小说章节，
+每个章节以"### Chapter <编号>"开头，随后是该章节的正文。
+请分别从每个章节中提取角色信息，严格按以下JSON格式返回：
+{
+    "results": [
+        {
+            "id": "章节编号（与'### Chapter'后的编号一致）",
+            "characters": [
+                {
+                    "name": "角色全名",
+                    "appearance": "外貌特征",
+                    "personality": "性格特点",
+                    "relationships": "人物关系",
+                    "first_appearance": "首次出现场景",
+                    "significance": "角色重要性"
+                }
+            ]
+        }
+    ]
+}
+
+内容要求：
+1. 必须使用简体中文
+2. 性格特点需详细描述
+3. 人物关系需说明与其他角色的互动
+4. 每个章节单独返回一项，没有角色的章节返回空列表
+5. 角色名称使用正文中最完整的称呼，同一角色的不同称呼只保留一项
+6. 只提取正文中明确出现的信息，没有提及的字段填写空字符串，不要编造
+7. 只返回JSON，不要包含任何解释或其他文字"""
+    
+    def __init__(self, model_name: str = "qwen3:4b", concurrency: int = 4, batch_size: int = 4,
+                 cache_dir: Optional[str] = ".novel_cache"):
         # 初始化配置
         self.model_name = model_name
         self.api_url = "http://localhost:11434/api/chat"
@@ -24,13 +135,37 @@ class NovelAnalyzer:
             "Content-Type": "application/json",
             "Accept-Charset": "utf-8"
         }
+        self.concurrency = max(1, concurrency)  # 并发请求数
+        self.batch_size = max(1, batch_size)  # 每次请求合并的章节数
         self.request_timeout = 3600  # 1小时超时
         self.max_retries = 3
-        self.retry_delay = 30
-        self.max_text_length = 5000
+        self.retry_base = 1.0  # 指数退避的基础等待秒数
+        self.retry_max_delay = 30
+        self.max_text_length = 5000  # 未安装tokenizer时按字符数截断
+        self.tokenizer_name = "Qwen/Qwen3-4B"
+        self.max_context_tokens = 3500  # 每章节的token上限，为SYSTEM_PROMPT和输出预留空间
+        self._tokenizer = None  # 延迟加载，False表示不可用
+        self._model_loaded = False  # 是否已通过keep_alive=-1让模型常驻
+        self.skip_max_length = 500  # 短于该长度且对白提示过少的章节不调用模型
+        self.skip_min_hints = 3
+        
+        # 上下文长度按批大小计算一次并在整个运行期间保持不变，
+        # 变化会导致模型重新加载、提示前缀缓存失效；按需计算也避免为KV缓存申请过多显存
+        self.prompt_headroom = 1024  # SYSTEM_PROMPT及消息格式占用的token
+        self.output_headroom = 1024  # 每章节输出JSON预留的token
+        chapter_tokens = self.max_context_tokens + self.output_headroom
+        self.num_ctx = -(-(self.batch_size * chapter_tokens + self.prompt_headroom) // 1024) * 1024
         
         # 初始化日志系统
         self._setup_logging()
+        
+        # 章节结果磁盘缓存（重复分析或失败重跑时跳过API调用）
+        self.cache = None
+        if cache_dir:
+            if diskcache is None:
+                self.logger.warning("未安装diskcache，结果缓存已禁用")
+            else:
+                self.cache = diskcache.Cache(cache_dir)
 
     def _setup_logging(self):
         """配置UTF-8日志系统"""
@@ -41,33 +176,99 @@ class NovelAnalyzer:
             '%(asctime)s - %(levelname)s - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
-        
-        # 控制台处理器
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        
-        # 文件处理器(UTF-8)
-        file_handler = logging.FileHandler(
-            'novel_analysis.log', 
-            mode='w', 
-            encoding='utf-8'
+        # 控制台和运行日志只输出错误信息，堆栈跟踪仅写入error.log
+        brief_formatter = _BriefFormatter(
+            '%(asctime)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
         )
-        file_handler.setFormatter(formatter)
         
-        self.logger.addHandler(console_handler)
-        self.logger.addHandler(file_handler)
+        # 各实例共用同一个logger，只挂载一次处理器，避免同一条日志被重复写入
+        if not self.logger.handlers:
+            # 控制台处理器
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(brief_formatter)
+            
+            # 文件处理器(UTF-8)
+            file_handler = logging.FileHandler(
+                'novel_analysis.log', 
+                mode='w', 
+                encoding='utf-8'
+            )
+            file_handler.setFormatter(brief_formatter)
+            
+            # 错误日志处理器（仅记录ERROR及以上级别，包含堆栈跟踪）
+            error_handler = logging.FileHandler(
+                'error.log',
+                mode='a',
+                encoding='utf-8'
+            )
+            error_handler.setLevel(logging.ERROR)
+            error_handler.setFormatter(formatter)
+            
+            self.logger.addHandler(console_handler)
+            self.logger.addHandler(file_handler)
+            self.logger.addHandler(error_handler)
         
-        # 错误日志重定向
-        sys.stderr = open('error.log', 'w', encoding='utf-8')
+        # API调试日志（常驻文件句柄，按大小轮转）
+        # 各实例共用同一个logger，只挂载一次处理器，避免重复写入和多个处理器轮转同一文件
+        self.api_logger = logging.getLogger('NovelAnalyzer.api')
+        self.api_logger.setLevel(logging.DEBUG)
+        self.api_logger.propagate = False
+        if not self.api_logger.handlers:
+            api_handler = logging.handlers.RotatingFileHandler(
+                'api_debug.log',
+                maxBytes=10 * 1024 * 1024,
+                backupCount=3,
+                encoding='utf-8'
+            )
+            api_handler.setFormatter(formatter)
+            self.api_logger.addHandler(api_handler)
 
     def _log_error(self, error: Exception, context: str = ""):
         """记录错误及堆栈跟踪"""
-        self.logger.error(f"{context} Error: {str(error)}")
-        with open('error.log', 'a', encoding='utf-8') as f:
-            f.write(f"\n\n--- Error at {time.strftime('%Y-%m-%d %H:%M:%S')} ---\n")
-            f.write(f"Context: {context}\n")
-            f.write("".join(traceback.format_exception(type(error), error, error.__traceback__)))
-            f.write("\n" + "-"*80 + "\n")
+        self.logger.error(f"{context} Error: {str(error)}", exc_info=error)
+
+    def _cache_key(self, text: str) -> str:
+        """根据模型名称、格式版本和章节文本生成缓存键"""
+        return hashlib.blake2b(
+            f"{self.model_name}|{SCHEMA_VERSION}|{text}".encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+
+    def _get_tokenizer(self):
+        """延迟加载与模型匹配的tokenizer（transformers为可选依赖）"""
+        if self._tokenizer is None:
+            try:
+                from transformers import AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+            except Exception as e:
+                self.logger.warning(f"无法加载tokenizer {self.tokenizer_name}，将按字符数截断: {e}")
+                self._tokenizer = False
+        return self._tokenizer or None
+
+    def _truncate_to_tokens(self, text: str, n_tokens: int) -> str:
+        """
+        将文本截断到指定的token数量
+        
+        Args:
+            text: 原始文本
+            n_tokens: token上限
+            
+        Returns:
+            截断后的文本
+        """
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            # 中文约1字1token，按字符截断时也不超过token上限，保证不超出num_ctx
+            return text[:min(self.max_text_length, n_tokens)]
+            
+        # 单个token很少超过8个字符，先粗略截断避免对超长章节整体编码
+        text = text[:n_tokens * 8]
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        if len(ids) <= n_tokens:
+            return text
+        # 在多字节字符中间截断时，末尾会解码出替换字符U+FFFD
+        return tokenizer.decode(ids[:n_tokens]).rstrip('\ufffd')
 
     def read_novel_file(self, file_path: str) -> Optional[str]:
         """
@@ -80,15 +281,45 @@ class NovelAnalyzer:
             文件内容字符串或None(失败时)
         """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            with open(file_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+                    # 直接从内存映射解码，省去先读入bytes再解码的中间副本
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        content = str(mm, 'utf-8')
+                else:
+                    # 管道、/dev/stdin等无法映射的输入（以及空文件）按流读取
+                    content = f.read().decode('utf-8')
+            # 与文本模式读取保持一致：统一换行符
+            if '\r' in content:
+                content = content.replace('\r\n', '\n').replace('\r', '\n')
             self.logger.info(f"成功读取文件: {file_path}")
             return content
         except Exception as e:
             self._log_error(e, f"读取文件失败: {file_path}")
             return None
 
-    def split_into_chapters(self, content: str) -> List[Dict[str, str]]:
+    @staticmethod
+    def _iter_chapters(content: str):
+        """单次扫描章节标题，每遇到下一个标题时产出上一章节（标题和正文各只切片一次）"""
+        def make_chapter(match, end_pos):
+            title_lo, title_hi = _trim_indices(content, *match.span(1))
+            body_lo, body_hi = _trim_indices(content, match.end(), end_pos)
+            return {
+                "title": content[title_lo:title_hi],
+                "idx": _parse_cn_int(match.group(2)),
+                "content": content[body_lo:body_hi]
+            }
+            
+        prev_match = None
+        for match in _CHAPTER_RE.finditer(content):
+            if prev_match is not None:
+                yield make_chapter(prev_match, match.start())
+            prev_match = match
+        if prev_match is not None:
+            yield make_chapter(prev_match, len(content))
+
+    def split_into_chapters(self, content: str) -> List[Dict[str, Any]]:
         """
         分割小说章节（支持'第51章 万药联盟的诞生'格式）
         
@@ -96,90 +327,130 @@ class NovelAnalyzer:
             content: 小说文本内容
             
         Returns:
-            章节列表，每个章节包含title和content
+            章节列表，每个章节包含title、idx(章节序号)和content
         """
         try:
-            # 匹配"第X章 标题"格式
-            pattern = re.compile(r'(第[0-9零一二三四五六七八九十百千万]+章\s[^\n]+)\n')
-            matches = list(pattern.finditer(content))
+            chapters = list(self._iter_chapters(content))
             
-            if not matches:
+            if not chapters:
                 self.logger.warning("未检测到章节标题，将全文作为单章处理")
-                return [{"title": "全文", "content": content}]
+                return [{"title": "全文", "idx": 0, "content": content}]
             
-            chapters = []
-            for i, match in enumerate(matches):
-                title = match.group(1).strip()
-                end_pos = matches[i+1].start() if i < len(matches)-1 else len(content)
-                chapters.append({
-                    "title": title,
-                    "content": content[match.end():end_pos].strip()
-                })
-            
-            self.logger.info(f"分割完成，共 {len(chapters)} 个章节")
-            for chap in chapters:
-                self.logger.info(f"章节: {chap['title']}")
+            # 所有标题合并为一条日志记录，避免每章一次处理器调用
+            self.logger.info(
+                f"分割完成，共 {len(chapters)} 个章节\n"
+                + "\n".join(f"章节: {chap['title']}" for chap in chapters)
+            )
+                
+            # 检查缺失的章节序号
+            indices = sorted({chap['idx'] for chap in chapters})
+            for prev_idx, idx in zip(indices, indices[1:]):
+                if idx - prev_idx > 1:
+                    self.logger.warning(f"章节序号不连续: 第{prev_idx}章与第{idx}章之间缺少 {idx - prev_idx - 1} 章")
                 
             return chapters
         except Exception as e:
             self._log_error(e, "章节分割失败")
             return []
 
-    def _call_model_api(self, prompt: str) -> Optional[Dict]:
+    def _should_skip(self, text: str) -> bool:
+        """短章节且几乎没有对白提示时认为不含人物，无需调用模型"""
+        if len(text) >= self.skip_max_length:
+            return False
+        hints = 0
+        for _ in _DIALOG_HINT.finditer(text):
+            hints += 1
+            if hints >= self.skip_min_hints:
+                return False
+        return True
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """创建异步HTTP客户端（所有请求共享连接池，保持与Ollama的keep-alive连接）"""
+        return httpx.AsyncClient(
+            headers=self.headers,
+            timeout=self.request_timeout,
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency
+            )
+        )
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """计算第attempt次重试前的等待时间（指数退避 + 随机抖动）"""
+        return min(self.retry_max_delay, self.retry_base * 2 ** attempt) * (0.5 + random.random())
+
+    async def _call_model_api_async(
+        self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, prompt: str
+    ) -> Optional[Dict]:
         """
         调用qwen3:4b模型API（带重试机制）
         
+        固定的SYSTEM_PROMPT始终作为第一条消息发送，配合固定的模型、
+        num_ctx和keep_alive，使Ollama能够复用已缓存的提示前缀。
+        
         Args:
-            prompt: 输入提示
+            client: 异步HTTP客户端
+            semaphore: 限制同时进行的请求数
+            prompt: 用户消息内容（仅包含章节文本）
             
         Returns:
             API响应数据或None(失败时)
         """
         for attempt in range(self.max_retries):
+            if attempt:
+                # 在并发名额之外异步等待，不阻塞其他批次的请求
+                await asyncio.sleep(self._backoff_delay(attempt - 1))
             try:
                 self.logger.info(f"调用模型API (尝试 {attempt+1}/{self.max_retries})")
                 
-                response = requests.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json={
-                        "model": self.model_name,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "stream": False,
-                        "format": "json"
-                    },
-                    timeout=self.request_timeout
-                )
-                
+                # 仅在实际请求期间占用并发名额，退避等待时让给其他批次
+                async with semaphore:
+                    async with client.stream(
+                        "POST",
+                        self.api_url,
+                        json={
+                            "model": self.model_name,
+                            "messages": [
+                                {"role": "system", "content": self.SYSTEM_PROMPT},
+                                {"role": "user", "content": prompt}
+                            ],
+                            "stream": True,
+                            "format": "json",
+                            "keep_alive": -1,
+                            "options": {"num_ctx": self.num_ctx}
+                        }
+                    ) as response:
+                        if response.status_code != 200:
+                            raw = await response.aread()
+                            self.api_logger.debug(
+                                "\n=== 请求 ===\n%s...\n=== 响应 %d ===\n%s",
+                                prompt[:200], response.status_code, raw[:1000].decode('utf-8', 'replace')
+                            )
+                            if 400 <= response.status_code < 500:
+                                # 客户端错误（如模型不存在），重试也不会成功
+                                self.logger.error(f"API错误状态码: {response.status_code}，不再重试")
+                                break
+                            self.logger.error(f"API错误状态码: {response.status_code}")
+                            continue
+                        
+                        content = await self._read_stream(response)
+                    
                 # 记录调试信息
-                with open('api_debug.log', 'a', encoding='utf-8') as f:
-                    f.write(f"\n\n=== 请求 ===\n{prompt[:200]}...\n")
-                    f.write(f"=== 响应 {response.status_code} ===\n{response.text[:1000]}\n")
-                
-                if response.status_code != 200:
-                    self.logger.error(f"API错误状态码: {response.status_code}")
-                    continue
+                self.api_logger.debug(
+                    "\n=== 请求 ===\n%s...\n=== 响应 %d ===\n%s",
+                    prompt[:200], response.status_code, (content or "")[:1000]
+                )
                 
-                # 安全解析JSON
-                try:
-                    data = response.json()
-                    if not isinstance(data, dict):
-                        self.logger.error("API返回了非字典格式数据")
-                        continue
-                        
-                    if 'message' not in data or 'content' not in data['message']:
-                        self.logger.error("响应缺少必要字段")
-                        continue
-                        
-                    return data
-                except json.JSONDecodeError as je:
-                    self.logger.error(f"JSON解析失败: {str(je)}")
+                if content is None:
                     continue
                     
-            except requests.exceptions.Timeout:
+                return {"message": {"role": "assistant", "content": content}}
+                    
+            except httpx.TimeoutException:
                 self.logger.warning(f"请求超时 (尝试 {attempt+1})")
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
+                continue
+            except httpx.TransportError as e:
+                self.logger.warning(f"网络错误 (尝试 {attempt+1}): {e}")
                 continue
             except Exception as e:
                 self._log_error(e, "API请求异常")
@@ -187,6 +458,45 @@ class NovelAnalyzer:
                 
         return None
 
+    async def _read_stream(self, response: httpx.Response) -> Optional[str]:
+        """
+        逐行解析流式(NDJSON)响应，边接收边拼接message.content
+        
+        Args:
+            response: 状态码为200的流式响应
+            
+        Returns:
+            完整的模型输出，或None(响应异常或不完整时)
+        """
+        parts = []
+        try:
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = _json_loads(line)
+                if not isinstance(chunk, dict):
+                    self.logger.error("API返回了非字典格式数据")
+                    return None
+                if 'error' in chunk:
+                    self.logger.error(f"API返回错误: {chunk['error']}")
+                    return None
+                    
+                message = chunk.get('message')
+                if isinstance(message, dict) and 'content' in message:
+                    parts.append(message['content'])
+                elif not chunk.get('done'):
+                    self.logger.error("响应缺少必要字段")
+                    return None
+                    
+                if chunk.get('done'):
+                    return "".join(parts)
+        except json.JSONDecodeError as je:
+            self.logger.error(f"JSON解析失败: {str(je)}")
+            return None
+            
+        self.logger.error("流式响应在完成前中断")
+        return None
+
     def extract_character_info(self, text: str) -> Optional[List[Dict]]:
         """
         从文本提取角色信息
@@ -197,41 +507,125 @@ class NovelAnalyzer:
         Returns:
             角色信息列表或None(失败时)
         """
-        prompt = f"""请从以下小说内容提取角色信息，严格按JSON格式返回：
-{{
-    "characters": [
-        {{
-            "name": "角色全名",
-            "appearance": "外貌特征",
-            "personality": "性格特点",
-            "relationships": "人物关系",
-            "first_appearance": "首次出现场景",
-            "significance": "角色重要性"
-        }}
-    ]
-}}
+        return self.extract_character_info_batch([text], ["0"]).get("0")
 
-内容要求：
-1. 必须使用简体中文
-2. 性格特点需详细描述
-3. 人物关系需说明与其他角色的互动
+    def extract_character_info_batch(self, texts: List[str], ids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        在一次请求中批量提取多个章节的角色信息（同步接口）
+        
+        Args:
+            texts: 要分析的文本列表
+            ids: 与texts一一对应的章节编号
+            
+        Returns:
+            按章节编号索引的角色信息字典（失败的章节不包含在内）
+        """
+        self._get_tokenizer()  # 在事件循环外加载tokenizer
+        
+        async def run():
+            async with self._create_client() as client:
+                semaphore = asyncio.Semaphore(self.concurrency)
+                return await self.extract_character_info_batch_async(client, semaphore, texts, ids)
+                
+        return asyncio.run(run())
 
-小说内容：
-{text[:self.max_text_length]}"""
+    async def extract_character_info_batch_async(
+        self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, texts: List[str], ids: List[str]
+    ) -> Dict[str, List[Dict]]:
+        """
+        在一次请求中批量提取多个章节的角色信息
         
-        response = self._call_model_api(prompt)
+        Args:
+            client: 异步HTTP客户端
+            semaphore: 限制同时进行的请求数
+            texts: 要分析的文本列表
+            ids: 与texts一一对应的章节编号
+            
+        Returns:
+            按章节编号索引的角色信息字典（失败的章节不包含在内）
+        """
+        # 分词编码是CPU密集的同步操作，放到线程中执行，避免阻塞其他批次的请求
+        texts = await asyncio.to_thread(
+            lambda: [self._truncate_to_tokens(text, self.max_context_tokens) for text in texts]
+        )
+        
+        results = {}
+        pending = {}  # 未命中缓存的章节: 编号 -> 发送的文本
+        for chapter_id, text in zip(ids, texts):
+            cached = self.cache.get(self._cache_key(text)) if self.cache is not None else None
+            if cached is not None:
+                results[chapter_id] = cached
+            else:
+                pending[chapter_id] = text
+                
+        if not pending:
+            return results
+            
+        prompt = "\n\n".join(
+            f"### Chapter {chapter_id}\n{text}"
+            for chapter_id, text in pending.items()
+        )
+        
+        response = await self._call_model_api_async(client, semaphore, prompt)
         if not response:
-            return None
+            return results
             
         try:
             content = response['message']['content']
-            data = json.loads(content)
-            if isinstance(data, dict) and 'characters' in data:
-                return data['characters']
+            data = _json_loads(content)
+            if isinstance(data, dict) and isinstance(data.get('results'), list):
+                for item in data['results']:
+                    if not isinstance(item, dict):
+                        continue
+                    chapter_id = str(item.get('id', '')).strip()
+                    characters = item.get('characters')
+                    if chapter_id in pending and isinstance(characters, list):
+                        results[chapter_id] = characters
+                        if self.cache is not None:
+                            self.cache.set(self._cache_key(pending[chapter_id]), characters, expire=None)
         except Exception as e:
-            self._log_error(e, "解析角色信息失败")
+            self._log_error(e, "解析批量角色信息失败")
             
-        return None
+        # 回复格式错误或漏掉部分章节时，逐章重新请求，避免一章出错拖累整批
+        missing = [chapter_id for chapter_id in pending if chapter_id not in results]
+        if missing and len(pending) > 1:
+            self.logger.warning(f"批量结果缺少章节 {', '.join(missing)}，改为逐章重新请求")
+            retried = await asyncio.gather(*(
+                self.extract_character_info_batch_async(client, semaphore, [pending[chapter_id]], [chapter_id])
+                for chapter_id in missing
+            ))
+            for chapter_result in retried:
+                results.update(chapter_result)
+            
+        return results
+
+    async def _process_all(self, batches: List[Tuple[List[str], List[str]]]) -> List[Dict[str, List[Dict]]]:
+        """
+        并发提交所有批次并等待全部完成
+        
+        Args:
+            batches: (章节文本列表, 章节编号列表) 组成的批次列表
+            
+        Returns:
+            与batches一一对应的分析结果（异常的批次返回空字典）
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async with self._create_client() as client:
+            results = await asyncio.gather(
+                *(self.extract_character_info_batch_async(client, semaphore, texts, ids)
+                  for texts, ids in batches),
+                return_exceptions=True
+            )
+            
+        batch_results = []
+        for result in results:
+            if isinstance(result, Exception):
+                self._log_error(result, "批次分析异常")
+                batch_results.append({})
+            else:
+                batch_results.append(result)
+        return batch_results
 
     def merge_character_data(self, characters_list: List[List[Dict]]) -> Dict[str, Dict]:
         """
@@ -243,7 +637,9 @@ class NovelAnalyzer:
         Returns:
             合并后的角色字典（按角色名索引）
         """
-        merged = {}
+        first_seen = {}  # 角色名 -> 首次出现时的完整信息
+        scenes = {}      # 角色名 -> 各章节的出现场景
+        candidates = {}  # 角色名 -> {字段: 候选值列表}
         
         for characters in characters_list:
             for char in characters:
@@ -251,50 +647,57 @@ class NovelAnalyzer:
                 if not name:
                     continue
                     
-                if name not in merged:
-                    merged[name] = {
-                        **char,
-                        'appearances': 1,
-                        'chapters': [char.get('first_appearance', '')]
-                    }
-                else:
-                    merged[name]['appearances'] += 1
-                    merged[name]['chapters'].append(char.get('first_appearance', ''))
+                if name not in first_seen:
+                    first_seen[name] = char
+                    scenes[name] = []
+                    candidates[name] = {field: [] for field in _MERGE_FIELDS}
                     
-                    # 合并各字段（保留最详细的信息）
-                    for field in ['appearance', 'personality', 'relationships', 'significance']:
-                        if field in char and char[field] and (
-                            field not in merged[name] or 
-                            len(char[field]) > len(merged[name].get(field, ''))
-                        ):
-                            merged[name][field] = char[field]
+                scenes[name].append(char.get('first_appearance', ''))
+                fields = candidates[name]
+                for field in _MERGE_FIELDS:
+                    value = char.get(field)
+                    if value:
+                        fields[field].append(value)
+        
+        # 合并各字段（保留最详细的信息，长度相同时保留先出现的）
+        merged = {}
+        for name, char in first_seen.items():
+            merged[name] = {
+                **char,
+                'appearances': len(scenes[name]),
+                'chapters': scenes[name]
+            }
+            for field, values in candidates[name].items():
+                if values:
+                    merged[name][field] = max(values, key=len)
                             
         return merged
 
-    def generate_final_report(self, chapters: List, characters: Dict, failed: int) -> str:
+    def write_final_report(self, out: TextIO, chapters: List, characters: Dict, failed: int, skipped: int = 0):
         """
-        生成最终分析报告
+        将最终分析报告逐段写入文件（不在内存中拼接整份报告）
         
         Args:
+            out: 已打开的文本输出流
             chapters: 章节列表
             characters: 合并后的角色字典
             failed: 失败章节数
-            
-        Returns:
-            格式化报告字符串
+            skipped: 未调用模型而直接跳过的章节数
         """
-        report = f"""=== 小说角色分析报告 ===
+        out.write(f"""=== 小说角色分析报告 ===
 
 【统计信息】
 总章节数: {len(chapters)}
-成功分析: {len(chapters) - failed}
+成功分析: {len(chapters) - failed - skipped}
 失败章节: {failed}
+跳过章节: {skipped}
 发现角色: {len(characters)}
 
 【角色详细信息】
-"""
+""")
+        separator = "━" * 60 + "\n"
         for name, data in characters.items():
-            report += f"""
+            out.write(f"""
 ■ 角色名称: {name}
     ▸ 出现次数: {data.get('appearances', 1)}
     ▸ 出现章节: {', '.join(data.get('chapters', []))}
@@ -302,25 +705,62 @@ class NovelAnalyzer:
     ▸ 性格特点: {data.get('personality', '无记录')}
     ▸ 人物关系: {data.get('relationships', '无记录')}
     ▸ 角色重要性: {data.get('significance', '无记录')}
-"""
-            report += "━" * 60 + "\n"
-            
-        return report
+""")
+            out.write(separator)
 
     def check_service_available(self) -> bool:
         """检查Ollama服务是否可用"""
         try:
-            response = requests.get(
+            response = httpx.get(
                 "http://localhost:11434/api/version",
                 timeout=10
             )
-            if response.status_code == 200:
-                return True
-            self.logger.error(f"服务返回错误状态码: {response.status_code}")
-            return False
+            if response.status_code != 200:
+                self.logger.error(f"服务返回错误状态码: {response.status_code}")
+                return False
         except Exception as e:
             self._log_error(e, "服务检查失败")
             return False
+        return True
+
+    def _load_model(self, keep_alive: int) -> bool:
+        """
+        加载或释放模型（空messages的chat请求只调整模型驻留，不生成内容）
+        
+        Args:
+            keep_alive: -1表示常驻直到显式释放，0表示立即释放显存
+            
+        Returns:
+            请求是否成功
+        """
+        action = "加载" if keep_alive else "释放"
+        try:
+            self.logger.info(f"{action}模型: {self.model_name}")
+            response = httpx.post(
+                self.api_url,
+                headers=self.headers,
+                json={
+                    "model": self.model_name,
+                    "messages": [],
+                    "keep_alive": keep_alive,
+                    # 与正式请求使用相同的num_ctx，避免首次调用时重新加载模型
+                    "options": {"num_ctx": self.num_ctx}
+                },
+                timeout=self.request_timeout
+            )
+            if response.status_code != 200:
+                self.logger.error(f"{action}模型失败，状态码: {response.status_code}")
+                return False
+            self._model_loaded = keep_alive != 0
+            return True
+        except Exception as e:
+            self._log_error(e, f"{action}模型失败")
+            return False
+
+    def close(self):
+        """释放常驻的模型显存"""
+        if self._model_loaded:
+            self._load_model(keep_alive=0)
 
     def process_novel(self, input_path: str, output_path: str):
         """
@@ -335,45 +775,76 @@ class NovelAnalyzer:
             self.logger.error("Ollama服务不可用，请先启动服务")
             return
 
-        # 第二步：读取文件
-        self.logger.info("开始处理小说文件...")
-        content = self.read_novel_file(input_path)
-        if not content:
+        # 预先加载模型常驻内存，处理结束（包括出错）时释放，keep_alive=-1不会自动过期
+        if not self._load_model(keep_alive=-1):
             return
+        try:
+            # 第二步：读取文件
+            self.logger.info("开始处理小说文件...")
+            content = self.read_novel_file(input_path)
+            if not content:
+                return
 
-        # 第三步：分割章节
-        chapters = self.split_into_chapters(content)
-        if not chapters:
-            self.logger.error("无法分割章节，处理终止")
-            return
+            # 第三步：分割章节
+            chapters = self.split_into_chapters(content)
+            if not chapters:
+                self.logger.error("无法分割章节，处理终止")
+                return
 
-        # 第四步：提取角色信息
-        self.logger.info("开始分析各章节角色...")
-        all_characters = []
-        failed_chapters = 0
+            # 第四步：提取角色信息
+            self.logger.info("开始分析各章节角色...")
+            all_characters = []
+            failed_chapters = 0
         
-        for chapter in chapters:
-            self.logger.info(f"正在处理: {chapter['title']}")
-            characters = self.extract_character_info(chapter['content'])
-            
-            if characters:
-                all_characters.append(characters)
-            else:
-                failed_chapters += 1
-                self.logger.warning(f"章节分析失败: {chapter['title']}")
+            # 跳过没有人物迹象的短章节，省去一次模型调用
+            ids = [str(i) for i in range(len(chapters))]
+            pending = []
+            skipped_ids = set()
+            for chapter_id, chapter in zip(ids, chapters):
+                if self._should_skip(chapter['content']):
+                    skipped_ids.add(chapter_id)
+                    self.logger.info(f"跳过无人物迹象的章节: {chapter['title']}")
+                else:
+                    pending.append((chapter_id, chapter))
+        
+            # 各章节相互独立，按批次合并后通过asyncio并发调用API
+            batches = [
+                ([chapter['content'] for _, chapter in pending[i:i + self.batch_size]],
+                 [chapter_id for chapter_id, _ in pending[i:i + self.batch_size]])
+                for i in range(0, len(pending), self.batch_size)
+            ]
+            self.logger.info(f"并发数: {self.concurrency}, 批大小: {self.batch_size}")
+            # 在事件循环外加载tokenizer，from_pretrained可能需要下载和读取较大的文件
+            self._get_tokenizer()
+            results = {}
+            for batch_result in asyncio.run(self._process_all(batches)):
+                results.update(batch_result)
+        
+            for chapter_id, chapter in zip(ids, chapters):
+                if chapter_id in skipped_ids:
+                    continue
+                characters = results.get(chapter_id)
+                if characters is None:
+                    failed_chapters += 1
+                    self.logger.warning(f"章节分析失败: {chapter['title']}")
+                elif characters:
+                    all_characters.append(characters)
 
-        # 第五步：合并角色信息
-        self.logger.info("合并角色信息...")
-        merged_characters = self.merge_character_data(all_characters)
+            # 第五步：合并角色信息
+            self.logger.info("合并角色信息...")
+            merged_characters = self.merge_character_data(all_characters)
+
+            # 第六步：生成报告
+            try:
+                # 1MiB写缓冲，减少write系统调用次数
+                with open(output_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                    self.write_final_report(f, chapters, merged_characters, failed_chapters, len(skipped_ids))
+                self.logger.info(f"分析报告已保存: {output_path}")
+            except Exception as e:
+                self._log_error(e, "写入报告文件失败")
+        finally:
+            self.close()
 
-        # 第六步：生成报告
-        report = self.generate_final_report(chapters, merged_characters, failed_chapters)
-        try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(report)
-            self.logger.info(f"分析报告已保存: {output_path}")
-        except Exception as e:
-            self._log_error(e, "写入报告文件失败")
 
 def main():
     """命令行入口"""
@@ -381,11 +852,26 @@ def main():
     parser.add_argument("-i", "--input", required=True, help="输入小说文件路径")
     parser.add_argument("-o", "--output", default="character_report.txt", help="输出报告文件路径")
     parser.add_argument("-m", "--model", default="qwen3:4b", help="使用的模型名称")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="并发请求数")
+    parser.add_argument("-b", "--batch-size", type=int, default=4, help="每次请求合并的章节数")
+    parser.add_argument("--cache-dir", default=".novel_cache", help="章节结果缓存目录")
+    parser.add_argument("--no-cache", action="store_true", help="禁用章节结果缓存")
+    parser.add_argument("--profile", metavar="FILE", help="用cProfile记录耗时并保存到FILE（可用pstats/snakeviz查看）")
     
     args = parser.parse_args()
     
-    analyzer = NovelAnalyzer(args.model)
-    analyzer.process_novel(args.input, args.output)
+    analyzer = NovelAnalyzer(
+        args.model,
+        args.concurrency,
+        args.batch_size,
+        cache_dir=None if args.no_cache else args.cache_dir
+    )
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(analyzer.process_novel, args.input, args.output)
+        profiler.dump_stats(args.profile)
+    else:
+        analyzer.process_novel(args.input, args.output)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
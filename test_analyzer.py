@@ -1,11 +1,63 @@
 # test.py
 
+import asyncio
+import io
+import json
+import logging
+import logging.handlers
+import os
+import re
+import threading
+
+import httpx
 import pytest
-from novel_analyzer import NovelAnalyzer
+from novel_analyzer import NovelAnalyzer, _parse_cn_int
+
+
+@pytest.fixture(autouse=True)
+def _isolate_cwd(tmp_path, monkeypatch):
+    """在临时目录中运行，日志文件不写入仓库目录"""
+    monkeypatch.chdir(tmp_path)
+
+
+def _ndjson(*chunks):
+    """构造Ollama流式响应体"""
+    return "".join(json.dumps(chunk, ensure_ascii=False) + "\n" for chunk in chunks).encode("utf-8")
+
+
+def _mock_analyzer(handler):
+    """返回请求全部由handler处理、重试不等待的分析器"""
+    analyzer = NovelAnalyzer(cache_dir=None)
+    analyzer._create_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    analyzer._backoff_delay = lambda attempt: 0
+    analyzer._tokenizer = False  # 不加载tokenizer，按字符数截断
+    return analyzer
+
+
+def _stub_model_loading(analyzer):
+    """跳过服务检查，记录模型加载/释放请求的keep_alive"""
+    calls = []
+
+    def load_model(keep_alive):
+        calls.append(keep_alive)
+        analyzer._model_loaded = keep_alive != 0
+        return True
+
+    analyzer.check_service_available = lambda: True
+    analyzer._load_model = load_model
+    return calls
+
+
+def _call_api(analyzer):
+    async def run():
+        async with analyzer._create_client() as client:
+            return await analyzer._call_model_api_async(client, asyncio.Semaphore(1), "### Chapter 0\n正文")
+    return asyncio.run(run())
+
 
 class TestNovelAnalyzer:
     def test_split_into_chapters_normal_case(self):
-        analyzer = NovelAnalyzer()
+        analyzer = NovelAnalyzer(cache_dir=None)
         content = """
         第1章 万药联盟的诞生
         这是第一章的内容。
@@ -22,7 +74,7 @@ class TestNovelAnalyzer:
         assert chapters[1]["content"] == "这是第二章的内容。"
 
     # def test_split_into_chapters_no_chapter_titles(self):
-    #     analyzer = NovelAnalyzer()
+    #     analyzer = NovelAnalyzer(cache_dir=None)
     #     content = """
     #     这是第一章的内容。
     #     这是第二章的内容。
@@ -34,7 +86,7 @@ class TestNovelAnalyzer:
     #     assert chapters[0]["content"] == "这是第一章的内容。这是第二章的内容。"
 
     def test_split_into_chapters_incorrect_chapter_titles(self):
-        analyzer = NovelAnalyzer()
+        analyzer = NovelAnalyzer(cache_dir=None)
         content = """
         第1章 万药联盟的诞生
         这是第一章的内容。
@@ -47,4 +99,249 @@ class TestNovelAnalyzer:
         assert chapters[0]["title"] == "第1章 万药联盟的诞生"
         assert chapters[0]["content"] == """这是第一章的内容。
         这是第二章的内容。"""
-   
\ No newline at end of file
+   
+    def test_split_into_chapters_trims_whitespace(self):
+        analyzer = NovelAnalyzer(cache_dir=None)
+        content = "第1章 开端　\n　　正文内容。\n\n第2章 空章\n \n第3章 结尾\n结尾内容。　"
+        chapters = analyzer.split_into_chapters(content)
+        assert [c["title"] for c in chapters] == ["第1章 开端", "第2章 空章", "第3章 结尾"]
+        assert chapters[0]["content"] == "正文内容。"
+        assert chapters[1]["content"] == ""
+        assert chapters[2]["content"] == "结尾内容。"
+
+    def test_merge_character_data_keeps_longest_fields(self):
+        analyzer = NovelAnalyzer(cache_dir=None)
+        merged = analyzer.merge_character_data([
+            [{"name": "林动", "personality": "坚毅", "appearance": "", "first_appearance": "第1章"}],
+            [{"name": "林动", "personality": "坚毅果敢", "appearance": "少年", "first_appearance": "第2章"},
+             {"name": "", "personality": "无名"}],
+            [{"name": "林动", "personality": "沉稳冷静", "first_appearance": "第3章"}],
+        ])
+        assert list(merged) == ["林动"]
+        assert merged["林动"]["appearances"] == 3
+        assert merged["林动"]["chapters"] == ["第1章", "第2章", "第3章"]
+        assert merged["林动"]["personality"] == "坚毅果敢"
+        assert merged["林动"]["appearance"] == "少年"
+
+    @pytest.mark.parametrize("text, expected", [
+        ("51", 51), ("十", 10), ("十二", 12), ("二十", 20),
+        ("一百零五", 105), ("三千二百一十", 3210), ("一万零一", 10001),
+    ])
+    def test_parse_cn_int(self, text, expected):
+        assert _parse_cn_int(text) == expected
+
+    def test_split_into_chapters_parses_index(self):
+        analyzer = NovelAnalyzer(cache_dir=None)
+        content = "第九章 起\n内容\n第十一章 承\n内容\n第51章 转\n内容"
+        chapters = analyzer.split_into_chapters(content)
+        assert [c["idx"] for c in chapters] == [9, 11, 51]
+
+    def test_should_skip_short_chapter_without_dialog(self):
+        analyzer = NovelAnalyzer(cache_dir=None)
+        assert analyzer._should_skip("山风吹过，落叶纷飞。")
+        assert not analyzer._should_skip("林动笑道：走。萧炎问道：去哪？林动答道：山里。")
+        assert not analyzer._should_skip("山" * 500)
+
+    def test_write_final_report(self):
+        analyzer = NovelAnalyzer(cache_dir=None)
+        out = io.StringIO()
+        characters = {"林动": {"appearances": 2, "chapters": ["第1章", "第2章"], "personality": "坚毅"}}
+        analyzer.write_final_report(out, [{}, {}, {}, {}], characters, failed=1, skipped=1)
+        report = out.getvalue()
+        assert "总章节数: 4\n成功分析: 2\n失败章节: 1\n跳过章节: 1\n发现角色: 1\n" in report
+        assert "■ 角色名称: 林动" in report
+        assert "▸ 出现章节: 第1章, 第2章" in report
+        assert "▸ 外貌特征: 无记录" in report
+
+    @pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="需要支持命名管道的系统")
+    def test_read_novel_file_from_fifo(self, tmp_path):
+        analyzer = NovelAnalyzer(cache_dir=None)
+        fifo = tmp_path / "novel.fifo"
+        os.mkfifo(fifo)
+        
+        def write():
+            with open(fifo, "wb") as f:
+                f.write("第1章 开端\r\n正文内容。\r\n".encode("utf-8"))
+                
+        writer = threading.Thread(target=write)
+        writer.start()
+        content = analyzer.read_novel_file(str(fifo))
+        writer.join()
+        assert content == "第1章 开端\n正文内容。\n"
+
+    def test_read_novel_file_regular_and_empty(self, tmp_path):
+        analyzer = NovelAnalyzer(cache_dir=None)
+        novel = tmp_path / "novel.txt"
+        novel.write_bytes("第1章 开端\n正文内容。\n".encode("utf-8"))
+        empty = tmp_path / "empty.txt"
+        empty.write_bytes(b"")
+        assert analyzer.read_novel_file(str(novel)) == "第1章 开端\n正文内容。\n"
+        assert analyzer.read_novel_file(str(empty)) == ""
+
+    def test_call_model_api_assembles_stream_chunks(self):
+        analyzer = _mock_analyzer(lambda request: httpx.Response(200, content=_ndjson(
+            {"message": {"role": "assistant", "content": '{"results": '}, "done": False},
+            {"message": {"role": "assistant", "content": '[]}'}, "done": False},
+            {"message": {"role": "assistant", "content": ""}, "done": True},
+        )))
+        assert _call_api(analyzer) == {"message": {"role": "assistant", "content": '{"results": []}'}}
+
+    def test_call_model_api_incomplete_stream_returns_none(self):
+        requests = []
+        
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, content=_ndjson(
+                {"message": {"role": "assistant", "content": '{"results": '}, "done": False}
+            ))
+            
+        analyzer = _mock_analyzer(handler)
+        assert _call_api(analyzer) is None
+        assert len(requests) == analyzer.max_retries
+
+    def test_call_model_api_error_chunk_returns_none(self):
+        analyzer = _mock_analyzer(lambda request: httpx.Response(200, content=_ndjson({"error": "out of memory"})))
+        assert _call_api(analyzer) is None
+
+    def test_call_model_api_client_error_is_not_retried(self):
+        requests = []
+        
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(404, json={"error": "model not found"})
+            
+        assert _call_api(_mock_analyzer(handler)) is None
+        assert len(requests) == 1
+
+    def test_call_model_api_server_error_is_retried(self):
+        requests = []
+        
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(503)
+            
+        analyzer = _mock_analyzer(handler)
+        assert _call_api(analyzer) is None
+        assert len(requests) == analyzer.max_retries
+
+    @staticmethod
+    def _results_handler(requests, answer):
+        """按answer(章节编号列表)决定回复中包含哪些章节"""
+        def handler(request):
+            prompt = json.loads(request.content)["messages"][-1]["content"]
+            ids = re.findall(r"### Chapter (\d+)", prompt)
+            requests.append(ids)
+            results = [{"id": chapter_id, "characters": [{"name": "林动"}]} for chapter_id in answer(ids)]
+            return httpx.Response(200, content=_ndjson(
+                {"message": {"role": "assistant", "content": json.dumps({"results": results})}, "done": True}
+            ))
+        return handler
+
+    def test_omitted_chapter_id_is_retried_alone(self):
+        requests = []
+        analyzer = _mock_analyzer(self._results_handler(requests, lambda ids: ids[:1]))  # 只回复第一章
+        result = analyzer.extract_character_info_batch(["甲", "乙"], ["0", "1"])
+        assert result == {"0": [{"name": "林动"}], "1": [{"name": "林动"}]}
+        assert requests == [["0", "1"], ["1"]]
+
+    def test_omitted_chapter_id_is_counted_as_failed(self, tmp_path):
+        requests = []
+        analyzer = _mock_analyzer(self._results_handler(
+            requests, lambda ids: [chapter_id for chapter_id in ids if chapter_id != "1"]  # 始终漏掉章节1
+        ))
+        assert analyzer.extract_character_info_batch(["甲", "乙"], ["0", "1"]) == {"0": [{"name": "林动"}]}
+        assert requests == [["0", "1"], ["1"]]
+        
+        loads = _stub_model_loading(analyzer)
+        novel = tmp_path / "novel.txt"
+        novel.write_text("第1章 起\n" + "山" * 600 + "\n第2章 承\n" + "水" * 600 + "\n", encoding="utf-8")
+        report = tmp_path / "report.txt"
+        analyzer.process_novel(str(novel), str(report))
+        assert "成功分析: 1\n失败章节: 1\n" in report.read_text(encoding="utf-8")
+        assert loads == [-1, 0]  # 处理结束后释放常驻的模型
+
+    def test_model_released_when_processing_fails(self, tmp_path):
+        analyzer = NovelAnalyzer(cache_dir=None)
+        loads = _stub_model_loading(analyzer)
+        
+        def fail(content):
+            raise RuntimeError("分割失败")
+        
+        analyzer.split_into_chapters = fail
+        novel = tmp_path / "novel.txt"
+        novel.write_text("第1章 起\n正文\n", encoding="utf-8")
+        with pytest.raises(RuntimeError):
+            analyzer.process_novel(str(novel), str(tmp_path / "report.txt"))
+        assert loads == [-1, 0]
+
+    @pytest.mark.parametrize("batch_size", [1, 4, 8])
+    def test_num_ctx_fits_batch(self, batch_size):
+        analyzer = NovelAnalyzer(cache_dir=None, batch_size=batch_size)
+        needed = batch_size * (analyzer.max_context_tokens + analyzer.output_headroom) + analyzer.prompt_headroom
+        assert analyzer.num_ctx % 1024 == 0
+        assert needed <= analyzer.num_ctx < needed + 1024
+
+    def test_api_log_handler_attached_once(self):
+        first = NovelAnalyzer(cache_dir=None)
+        second = NovelAnalyzer(cache_dir=None)
+        assert first.api_logger is second.api_logger
+        # pytest会临时挂载自己的LogCaptureHandler，只统计文件处理器
+        rotating = [h for h in second.api_logger.handlers
+                    if isinstance(h, logging.handlers.RotatingFileHandler)]
+        assert len(rotating) == 1
+
+    def test_traceback_only_in_error_log(self):
+        NovelAnalyzer(cache_dir=None)
+        analyzer = NovelAnalyzer(cache_dir=None)
+        try:
+            raise ValueError("坏数据")
+        except ValueError as e:
+            record = analyzer.logger.makeRecord(
+                analyzer.logger.name, logging.ERROR, __file__, 0, "解析失败", None, (type(e), e, e.__traceback__))
+        outputs = {}
+        for handler in analyzer.logger.handlers:
+            if isinstance(handler, logging.FileHandler):
+                name = os.path.basename(handler.baseFilename)
+            elif type(handler) is logging.StreamHandler:  # 排除pytest的LogCaptureHandler
+                name = "console"
+            else:
+                continue
+            assert name not in outputs  # 多个实例不重复挂载处理器
+            outputs[name] = handler.format(record)
+        assert "Traceback" in outputs["error.log"]
+        assert "Traceback" not in outputs["novel_analysis.log"]
+        assert "Traceback" not in outputs["console"]
+
+    def test_truncate_drops_partial_character(self):
+        class ByteTokenizer:
+            """按UTF-8字节分词，截断位置可能落在多字节字符中间"""
+            def encode(self, text, add_special_tokens=False):
+                return list(text.encode("utf-8"))
+
+            def decode(self, ids):
+                return bytes(ids).decode("utf-8", errors="replace")
+
+        analyzer = NovelAnalyzer(cache_dir=None)
+        analyzer._tokenizer = ByteTokenizer()
+        assert analyzer._truncate_to_tokens("张三李四", 7) == "张三"
+
+    def test_truncate_runs_off_event_loop(self):
+        loop_threads = []
+
+        def handler(request):
+            body = json.loads(request.content)
+            ids = re.findall(r"### Chapter (\S+)", body["messages"][-1]["content"])
+            results = [{"id": i, "characters": []} for i in ids]
+            return httpx.Response(200, content=_ndjson(
+                {"message": {"content": json.dumps({"results": results})}, "done": True}))
+
+        analyzer = _mock_analyzer(handler)
+        truncate = analyzer._truncate_to_tokens
+
+        def record_thread(text, n_tokens):
+            loop_threads.append(threading.current_thread() is threading.main_thread())
+            return truncate(text, n_tokens)
+
+        analyzer._truncate_to_tokens = record_thread
+        assert analyzer.extract_character_info_batch(["正文"], ["0"]) == {"0": []}
+        assert loop_threads == [False]